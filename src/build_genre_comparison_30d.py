@@ -1,68 +1,73 @@
 #!/usr/bin/env python3
-import pandas as pd, pathlib as P, ast
-from datetime import datetime, timedelta, timezone
+import pandas as pd, numpy as np, pathlib as P
 
 ROOT = P.Path(__file__).resolve().parents[1]
 PROC = ROOT / "data" / "processed"
 
-def to_list(x):
-    if isinstance(x, list): return x
-    if pd.isna(x) or not isinstance(x, str): return []
-    try:
-        v = ast.literal_eval(x)
-        return v if isinstance(v, list) else []
-    except Exception:
-        return []
+TRACK_COLS = ["track_id","track_name","artist_id","artist_name","album_name"]
+STR_DTYPES = {c: "string[pyarrow]" for c in TRACK_COLS}
 
 def load_required():
-    recent = pd.read_csv(PROC / "recently_played.csv", parse_dates=["played_at"])
-    saved  = pd.read_csv(PROC / "saved_tracks.csv",    parse_dates=["added_at"])
-    genres = pd.read_csv(PROC / "artist_genres.csv")
-    genres["genres"] = genres["genres"].apply(to_list)
+    recent = pd.read_parquet(PROC / "recently_played.parquet", columns=TRACK_COLS + ["played_at"])
+    saved  = pd.read_parquet(PROC / "saved_tracks.parquet",    columns=TRACK_COLS)
+    genres = pd.read_parquet(PROC / "artist_genres.parquet",   columns=["artist_id","artist_name","genres"])
+    # no-ops for files written by fetch_spotify_data.py; normalizes older object-dtype files
+    recent, saved = recent.astype(STR_DTYPES), saved.astype(STR_DTYPES)
+    genres = genres.astype({c: STR_DTYPES[c] for c in ("artist_id","artist_name")})
+    # datetime64[ns, UTC] keeps the 30-day cut a plain int64 compare
+    recent["played_at"] = pd.to_datetime(recent["played_at"], utc=True, cache=True)
     return recent, saved, genres
 
 def explode_with_genres(df_tracks, genres):
-    cols = ["track_id","track_name","artist_id","artist_name","album_name"]
-    base = df_tracks[cols].drop_duplicates()
-    merged = base.merge(genres[["artist_id","artist_name","genres"]],
-                        on=["artist_id","artist_name"], how="left")
-    merged["genres"] = merged["genres"].apply(to_list)
+    # one row per distinct track, carrying its most recent play (NaT if never played)
+    base = (df_tracks.sort_values("played_at", ascending=False, na_position="last")
+                     .drop_duplicates(subset=TRACK_COLS)[TRACK_COLS + ["played_at"]])
+    # artist_id alone determines genres; share one categorical dtype so the join hashes int codes
+    genres = genres.drop_duplicates("artist_id")[["artist_id","genres"]]
+    ids = pd.CategoricalDtype(pd.concat([base["artist_id"], genres["artist_id"]]).dropna().unique())
+    base = base.astype({"artist_id": ids})
+    genres = genres.astype({"artist_id": ids})
+    merged = base.join(genres.set_index("artist_id")["genres"], on="artist_id", validate="m:1")
+    # unmatched artists come through as NaN and are dropped after the explode
     return merged.explode("genres").dropna(subset=["genres"])
 
+def genre_sizes(exploded, size_col):
+    codes, uniques = pd.factorize(exploded["genres"].to_numpy(), sort=False)
+    return pd.DataFrame({"genre": uniques, size_col: np.bincount(codes, minlength=len(uniques))})
+
 def main():
     recent, saved, genres = load_required()
 
-    now = datetime.now(timezone.utc)
-    cutoff = now - timedelta(days=30)
-    recent_30 = recent[recent["played_at"] >= cutoff]
+    cutoff = pd.Timestamp.now(tz="UTC") - pd.Timedelta(days=30)
 
-    exp_30  = explode_with_genres(recent_30, genres)
-    exp_all = explode_with_genres(pd.concat([recent, saved], ignore_index=True), genres)
+    # merge + explode once over recent ∪ saved, then cut the 30-day window from the result
+    unplayed = pd.Series(pd.NaT, index=saved.index, dtype=recent["played_at"].dtype)
+    plays = pd.concat([recent, saved.assign(played_at=unplayed)], ignore_index=True)
+    exp_all = explode_with_genres(plays, genres)
+    exp_30  = exp_all.loc[exp_all["played_at"].values >= cutoff.to_datetime64()]
 
     if exp_all.empty:
         out = PROC / "genre_compare_30d.csv"
         pd.DataFrame(columns=["genre","size_30","pct_30","size_all","pct_all","lift"]).to_csv(out, index=False)
         print(f"✅ Wrote {out} (empty)"); return
 
-    g30  = exp_30.groupby("genres", as_index=False).size().rename(columns={"genres":"genre","size":"size_30"})
-    gall = exp_all.groupby("genres", as_index=False).size().rename(columns={"genres":"genre","size":"size_all"})
+    g30  = genre_sizes(exp_30,  "size_30")
+    gall = genre_sizes(exp_all, "size_all")
 
     comp = gall.merge(g30, on="genre", how="left")
-    comp["size_30"] = comp["size_30"].fillna(0).astype(int)
-
-    total_30  = comp["size_30"].sum()
-    total_all = comp["size_all"].sum()
-    comp["pct_30"]  = (comp["size_30"]  / total_30)  if total_30  > 0 else 0
-    comp["pct_all"] = (comp["size_all"] / total_all) if total_all > 0 else 0
-    comp["lift"]    = comp.apply(lambda r: (r["pct_30"]/r["pct_all"]) if r["pct_all"]>0 else None, axis=1)
 
-    # round for readability
-    comp["pct_30"]  = comp["pct_30"].round(4)
-    comp["pct_all"] = comp["pct_all"].round(4)
-    comp["lift"]    = comp["lift"].round(2)
+    # shares and lift in one pass over the raw arrays
+    s30  = comp["size_30"].fillna(0).to_numpy(dtype=int)
+    sall = comp["size_all"].to_numpy(dtype=float)
+    t30, tall = s30.sum(), sall.sum()
+    pct30  = s30  / t30  if t30  else np.zeros_like(sall)
+    pctall = sall / tall if tall else np.zeros_like(sall)
+    lift = np.divide(pct30, pctall, out=np.full_like(pctall, np.nan), where=pctall > 0)
 
-    comp = comp.sort_values(["lift","size_30"], ascending=[False, False])
-    comp = comp[["genre","size_all","size_30","pct_30","pct_all","lift"]]
+    # derived columns attached once (rounded for readability), then ordered
+    comp = (comp.assign(size_30=s30, pct_30=pct30.round(4), pct_all=pctall.round(4), lift=lift.round(2))
+                .sort_values(["lift","size_30"], ascending=[False, False])
+                [["genre","size_all","size_30","pct_30","pct_all","lift"]])
 
     out = PROC / "genre_compare_30d.csv"
     comp.to_csv(out, index=False)
@@ -1,44 +1,38 @@
 #!/usr/bin/env python3
-import pandas as pd, pathlib as P, ast, sys
+import pandas as pd, numpy as np, pathlib as P, sys
+import pyarrow.parquet as pq
 
 ROOT = P.Path(__file__).resolve().parents[1]
 PROC = ROOT / "data" / "processed"
 
-def to_list(x):
-    if isinstance(x, list): return x
-    if pd.isna(x) or not isinstance(x, str): return []
-    try:
-        v = ast.literal_eval(x)
-        return v if isinstance(v, list) else []
-    except Exception:
-        return []
-
 def main():
-    recent_p = PROC / "recently_played.csv"
-    saved_p  = PROC / "saved_tracks.csv"
-    genres_p = PROC / "artist_genres.csv"
+    recent_p = PROC / "recently_played.parquet"
+    saved_p  = PROC / "saved_tracks.parquet"
+    genres_p = PROC / "artist_genres.parquet"
     for p in (recent_p, saved_p, genres_p):
         if not p.exists():
             sys.exit(f"Missing {p}. Run fetch_spotify_data.py first.")
 
-    recent = pd.read_csv(recent_p)
-    saved  = pd.read_csv(saved_p)
-    genres = pd.read_csv(genres_p)
-
     common = ["track_id","track_name","artist_id","artist_name","album_name"]
-    for col in common:
-        for name, df in (("recently_played", recent), ("saved_tracks", saved)):
-            if col not in df.columns:
+    for name, p in (("recently_played", recent_p), ("saved_tracks", saved_p)):
+        present = pq.read_schema(p).names
+        for col in common:
+            if col not in present:
                 sys.exit(f"{name} is missing column '{col}'")
 
+    str_dtypes = {c: "string[pyarrow]" for c in common}
+    recent = pd.read_parquet(recent_p, columns=common).astype(str_dtypes)
+    saved  = pd.read_parquet(saved_p,  columns=common).astype(str_dtypes)
+    genres = pd.read_parquet(genres_p)
+
     combo = pd.concat([recent[common], saved[common]], ignore_index=True).drop_duplicates()
 
     if genres.empty or "artist_id" not in genres.columns or "genres" not in genres.columns:
-        sys.exit("artist_genres.csv is empty or missing required columns.")
+        sys.exit("artist_genres.parquet is empty or missing required columns.")
 
-    df = combo.merge(genres[["artist_id","artist_name","genres"]],
-                     on=["artist_id","artist_name"], how="left")
-    df["genres"] = df["genres"].apply(to_list)
+    genres = genres.astype({"artist_id": "string[pyarrow]", "artist_name": "string[pyarrow]"})
+    df = combo.join(genres.drop_duplicates("artist_id").set_index("artist_id")["genres"],
+                    on="artist_id", validate="m:1")
 
     exploded = df.explode("genres").dropna(subset=["genres"])
     if exploded.empty:
@@ -46,8 +40,9 @@ def main():
         pd.DataFrame(columns=["genres","size"]).to_csv(out, index=False)
         print(f"✅ Wrote {out} (empty)"); return
 
-    counts = (exploded.groupby("genres", as_index=False)
-              .size().sort_values("size", ascending=False))
+    codes, uniques = pd.factorize(exploded["genres"].to_numpy(), sort=False)
+    counts = (pd.DataFrame({"genres": uniques, "size": np.bincount(codes, minlength=len(uniques))})
+              .sort_values("size", ascending=False))
 
     out = PROC / "genre_summary.csv"
     counts.to_csv(out, index=False)
@@ -0,0 +1,87 @@
+# src/data_io.py
+"""Shared loaders for the cached files in data/processed/ (Parquet first, CSV fallback)."""
+import ast
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+
+PROC = Path("data/processed")
+# Arrow list<string> keeps genres out of Python objects; explode flattens it natively.
+# (pa.list_, not pa.large_list: exploding large_list columns is a no-op in some pandas versions)
+GENRE_LIST = pd.ArrowDtype(pa.list_(pa.string()))
+
+def _literal_list(x: str) -> list:
+    try:
+        v = ast.literal_eval(x)
+        return v if isinstance(v, list) else []
+    except Exception:
+        return [s.strip() for s in x.split(",") if s.strip()]
+
+def ensure_genre_list(df_gen: pd.DataFrame) -> pd.DataFrame:
+    """Canonicalize `genres` to an Arrow list<string> column; run once at load time, not per use."""
+    if df_gen.empty or "genres" not in df_gen.columns or df_gen["genres"].dtype == GENRE_LIST:
+        return df_gen
+    s = df_gen["genres"].astype(object)
+    starts = s.str.startswith("[")           # NaN for non-string cells
+    is_text = starts.notna()
+    bracketed = starts.eq(True)
+    listy = ~is_text & s.map(pd.api.types.is_list_like)
+    parts = [
+        s[bracketed].map(_literal_list),     # "['a', 'b']" / JSON arrays
+        s[is_text & ~bracketed].str.split(",").map(lambda xs: [x.strip() for x in xs if x.strip()]),
+        s[listy].map(list),                  # lists / ndarrays from Parquet
+        pd.Series([[] for _ in range(int((~is_text & ~listy).sum()))],
+                  index=s.index[~is_text & ~listy], dtype=object),
+    ]
+    parsed = pd.concat(parts).reindex(s.index)
+    return df_gen.assign(genres=pd.array(parsed.tolist(), dtype=GENRE_LIST))
+
+def _prepare(df: pd.DataFrame, sort_by=None) -> pd.DataFrame:
+    df = ensure_genre_list(df)
+    if sort_by and sort_by in df.columns:
+        # sorted once per file version so time windows can be cut with searchsorted
+        df = df.dropna(subset=[sort_by]).sort_values(sort_by, ignore_index=True)
+    return df
+
+@st.cache_data(show_spinner=False)
+def load_csv(path_str: str, mtime: float, parse_dates=None, sort_by=None) -> pd.DataFrame:
+    # mtime is only part of the cache key, so a refreshed file is re-read;
+    # genres are parsed to lists here, once per file version
+    return _prepare(pd.read_csv(path_str, parse_dates=parse_dates), sort_by)
+
+@st.cache_data(show_spinner=False)
+def load_parquet(path_str: str, mtime: float, sort_by=None) -> pd.DataFrame:
+    return _prepare(pd.read_parquet(path_str, engine="pyarrow"), sort_by)
+
+def write_parquet(df: pd.DataFrame, path: Path) -> None:
+    # no pandas schema metadata: it would record genres as 'list<item: string>[pyarrow]',
+    # a dtype string pd.read_parquet can't rebuild; the Arrow list type alone round-trips
+    table = pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(None)
+    pq.write_table(table, path, compression="zstd")
+
+def source_path(name: str) -> Path | None:
+    """The file load_processed reads for `name`: the Parquet copy unless the CSV is newer."""
+    pq_path, csv_path = PROC / f"{name}.parquet", PROC / f"{name}.csv"
+    if pq_path.exists() and (not csv_path.exists() or pq_path.stat().st_mtime >= csv_path.stat().st_mtime):
+        return pq_path
+    return csv_path if csv_path.exists() else None
+
+def source_version(*names: str) -> tuple:
+    """Hashable cache key that changes whenever any of the named inputs is refreshed."""
+    return tuple((p.name, p.stat().st_mtime) if p else None for p in map(source_path, names))
+
+def load_processed(name: str, parse_dates=None, sort_by=None) -> pd.DataFrame:
+    """Parquet first (typed, list-valued genres); else parse the CSV once and write a Parquet sidecar."""
+    path = source_path(name)
+    if path is None:
+        return pd.DataFrame()
+    if path.suffix == ".parquet":
+        return load_parquet(str(path), path.stat().st_mtime, sort_by)
+    df = load_csv(str(path), path.stat().st_mtime, parse_dates, sort_by)
+    try:
+        write_parquet(df, PROC / f"{name}.parquet")
+    except Exception:
+        pass  # the sidecar is only a speed-up; keep serving from the CSV
+    return df
@@ -1,14 +1,21 @@
 import os
+import json
 import time
-from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pac
 from dotenv import load_dotenv
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
 
 DATA_DIR = "data/processed"
 RAW_DIR = "data/raw"
+ARTIST_CACHE = f"{RAW_DIR}/artist_genres_cache.parquet"
+MAX_WORKERS = 6  # concurrent Spotify requests; spotipy retries on 429
+STR_DTYPE = "string[pyarrow]"  # Arrow-backed strings: contiguous buffers for hashing/joins
 
 KEY_NAMES = ["C","C♯/D♭","D","D♯/E♭","E","F","F♯/G♭","G","G♯/A♭","A","A♯/B♭","B"]
 
@@ -29,6 +36,13 @@ def chunked(seq, n):
     for i in range(0, len(seq), n):
         yield seq[i:i+n]
 
+def unique_ids(arrays):
+    # Hash-based dedup over all id columns at once; drops missing ids
+    if not arrays:
+        return []
+    ids = pd.unique(np.concatenate(arrays))
+    return ids[pd.notna(ids)].tolist()
+
 def fetch_top(sp, entity="artists", time_range="medium_term", limit=50):
     if entity == "artists":
         res = sp.current_user_top_artists(limit=limit, time_range=time_range)
@@ -39,8 +53,9 @@ def fetch_top(sp, entity="artists", time_range="medium_term", limit=50):
 def fetch_recently_played(sp, limit=50, after_days=365):
     # Page backwards from "now" until we hit cutoff or run out
     items = []
-    before = int(datetime.now(timezone.utc).timestamp() * 1000)
-    cutoff = int((datetime.now(timezone.utc) - pd.Timedelta(days=after_days)).timestamp() * 1000)
+    now = datetime.now(timezone.utc)
+    before = int(now.timestamp() * 1000)
+    cutoff = int((now - timedelta(days=after_days)).timestamp() * 1000)
 
     while True:
         res = sp.current_user_recently_played(limit=min(limit, 50), before=before)
@@ -51,7 +66,9 @@ def fetch_recently_played(sp, limit=50, after_days=365):
         items.extend(batch)
 
         # compute next 'before' from the oldest item in this batch
-        oldest_ms = min(int(pd.to_datetime(i["played_at"]).timestamp() * 1000) for i in batch)
+        # (fromisoformat is C-implemented; Python 3.10 needs the 'Z' spelled as an offset)
+        oldest_ms = min(int(datetime.fromisoformat(i["played_at"].replace("Z", "+00:00")).timestamp() * 1000)
+                        for i in batch)
         before = oldest_ms - 1
 
         if before < cutoff:
@@ -64,19 +81,18 @@ def fetch_recently_played(sp, limit=50, after_days=365):
     return items
 
 def fetch_saved_tracks(sp, max_total=5000):
-    items = []
+    # First page tells us the library size; fetch the remaining pages concurrently
     limit = 50
-    offset = 0
-    while True:
-        res = sp.current_user_saved_tracks(limit=limit, offset=offset)
-        batch = res.get("items", [])
-        if not batch:
-            break
-        items.extend(batch)
-        if len(batch) < limit or len(items) >= max_total:
-            break
-        offset += limit
-        time.sleep(0.1)
+    first = sp.current_user_saved_tracks(limit=limit, offset=0)
+    items = first.get("items", [])
+    total = min(first.get("total") or 0, max_total)
+    offsets = range(limit, total, limit)
+    if len(items) < limit or not offsets:
+        return items
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        pages = ex.map(lambda off: sp.current_user_saved_tracks(limit=limit, offset=off), offsets)
+        for res in pages:
+            items.extend(res.get("items", []))
     return items
 
 def get_audio_features(sp, track_ids):
@@ -98,35 +114,69 @@ def get_audio_features(sp, track_ids):
         print("audio_features blocked or failed (continuing without features):", repr(e))
         return []
 
+def fetch_artist_genres(sp, artist_ids):
+    """
+    Genres rarely change, so artists are cached on disk by id and only
+    ids missing from the cache are requested from /artists.
+    """
+    cols = ["artist_id", "artist_name", "genres"]
+    if os.path.exists(ARTIST_CACHE):
+        cache = pd.read_parquet(ARTIST_CACHE, columns=cols)
+        cache["genres"] = cache["genres"].map(list)
+    else:
+        cache = pd.DataFrame(columns=cols)
+    missing = sorted(set(artist_ids) - set(cache["artist_id"]))
+
+    genres_rows = []
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        batches = ex.map(lambda group: sp.artists(group)["artists"], chunked(missing, 50))
+        for arts in batches:
+            for a in arts:
+                genres_rows.append({
+                    "artist_id": a.get("id"),
+                    "artist_name": a.get("name"),
+                    "genres": a.get("genres") or []
+                })
+    if genres_rows:
+        cache = pd.concat([cache, pd.DataFrame(genres_rows, columns=cols)], ignore_index=True)
+        cache = cache.astype({"artist_id": STR_DTYPE, "artist_name": STR_DTYPE})
+        cache.to_parquet(ARTIST_CACHE, engine="pyarrow", compression="zstd", index=False)
+
+    return cache[cache["artist_id"].isin(artist_ids)].reset_index(drop=True)
+
+def normalize_tracks(items, ts_col):
+    # Flatten the item dicts in one json_normalize call, reindexed so fields missing from the
+    # whole batch come back as NaN (as .get() did); the first artist is pulled out with the
+    # .str accessor (list index, then dict key) rather than a per-item loop
+    flat = pd.json_normalize(items).reindex(
+        columns=[ts_col, "track.id", "track.name", "track.artists", "track.album.name"])
+    first_artist = flat["track.artists"].astype(object)
+    if first_artist.notna().any():
+        first_artist = first_artist.str[0].astype(object)  # NaN for an empty artists list
+    if first_artist.notna().any():
+        artist_id, artist_name = first_artist.str["id"], first_artist.str["name"]
+    else:
+        # no item in the batch has an artist: .str would reject the all-NaN column
+        artist_id = artist_name = pd.Series(None, index=flat.index, dtype=object)
+    return pd.DataFrame({
+        ts_col: pd.to_datetime(flat[ts_col], utc=True, cache=True, format="ISO8601"),
+        "track_id": pd.array(flat["track.id"], dtype=STR_DTYPE),
+        "track_name": pd.array(flat["track.name"], dtype=STR_DTYPE),
+        "artist_id": pd.array(artist_id, dtype=STR_DTYPE),
+        "artist_name": pd.array(artist_name, dtype=STR_DTYPE),
+        "album_name": pd.array(flat["track.album.name"], dtype=STR_DTYPE),
+    }, copy=False)
+
 def normalize_recent(items):
-    rows = []
-    for it in items:
-        played_at = pd.to_datetime(it["played_at"])
-        track = it["track"]
-        rows.append({
-            "played_at": played_at,
-            "track_id": track.get("id"),
-            "track_name": track.get("name"),
-            "artist_id": track["artists"][0]["id"] if track.get("artists") else None,
-            "artist_name": track["artists"][0]["name"] if track.get("artists") else None,
-            "album_name": (track.get("album") or {}).get("name"),
-        })
-    return pd.DataFrame(rows)
+    return normalize_tracks(items, "played_at")
 
 def normalize_saved(items):
-    rows = []
-    for it in items:
-        added_at = pd.to_datetime(it["added_at"])
-        track = it["track"]
-        rows.append({
-            "added_at": added_at,
-            "track_id": track.get("id"),
-            "track_name": track.get("name"),
-            "artist_id": track["artists"][0]["id"] if track.get("artists") else None,
-            "artist_name": track["artists"][0]["name"] if track.get("artists") else None,
-            "album_name": (track.get("album") or {}).get("name"),
-        })
-    return pd.DataFrame(rows)
+    return normalize_tracks(items, "added_at")
+
+def write_csv(df, path):
+    # Arrow's multi-threaded C++ writer streams batches instead of building one big string
+    # buffer. Flat columns only; frames with nested list/dict columns keep DataFrame.to_csv.
+    pac.write_csv(pa.Table.from_pandas(df, preserve_index=False), path)
 
 def main():
     os.makedirs(DATA_DIR, exist_ok=True)
@@ -138,12 +188,21 @@ def main():
         "user-top-read user-read-recently-played user-library-read playlist-modify-private"
     )
     sp = sp_client(scopes)
+    # Authorize once on the main thread before any pool starts: SpotifyOAuth has no lock, so
+    # concurrent first calls would each run the browser flow (and fight over the redirect
+    # port) or all refresh an expired token at once. Workers then only read the cached token.
+    sp.auth_manager.get_access_token(as_dict=False)
 
     # 1) Top Artists/Tracks across ranges
+    ranges = ["short_term", "medium_term", "long_term"]
+    jobs = [(entity, rng, 50) for rng in ranges for entity in ("artists", "tracks")]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        tops = dict(zip(jobs, ex.map(lambda job: fetch_top(sp, *job), jobs)))
+
     frames_artists, frames_tracks = [], []
-    for rng in ["short_term", "medium_term", "long_term"]:
-        arts = fetch_top(sp, "artists", rng, 50)
-        trs  = fetch_top(sp, "tracks",  rng, 50)
+    for rng in ranges:
+        arts = tops[("artists", rng, 50)]
+        trs  = tops[("tracks",  rng, 50)]
 
         df_a = pd.json_normalize(arts)
         if not df_a.empty:
@@ -159,7 +218,6 @@ def main():
     top_tracks  = pd.concat(frames_tracks,  ignore_index=True) if frames_tracks  else pd.DataFrame()
 
     # 2) Recently Played (~365 days back, paged)
-    # Seed call not strictly needed; we normalize below
     rec_all = fetch_recently_played(sp, limit=50, after_days=365)
     recent_df = normalize_recent(rec_all) if rec_all else pd.DataFrame()
 
@@ -168,13 +226,10 @@ def main():
     saved_df = normalize_saved(saved_items) if saved_items else pd.DataFrame()
 
  # --- 4) Audio Features for tracks we’ve seen ---
-    track_ids = set()
-    for df in [top_tracks, recent_df, saved_df]:
-        if not df.empty and "track_id" in df.columns:
-            track_ids.update(df["track_id"].dropna().tolist())
-        elif not df.empty and "id" in df.columns:
-            track_ids.update(df["id"].dropna().tolist())
-    track_ids = [t for t in track_ids if isinstance(t, str)]
+    arrs = [df["track_id" if "track_id" in df.columns else "id"].to_numpy(dtype=object)
+            for df in [top_tracks, recent_df, saved_df]
+            if not df.empty and ("track_id" in df.columns or "id" in df.columns)]
+    track_ids = unique_ids(arrs)
     feats_df = pd.DataFrame()
     try:
         features = get_audio_features(sp, track_ids) if track_ids else []
@@ -192,38 +247,33 @@ def main():
 
 
     # 5) Artist genres from recent & saved
-    artist_ids = set()
-    for df in [recent_df, saved_df]:
-        if not df.empty and "artist_id" in df.columns:
-            artist_ids.update(df["artist_id"].dropna().tolist())
+    artist_ids = unique_ids([df["artist_id"].to_numpy(dtype=object)
+                             for df in [recent_df, saved_df]
+                             if not df.empty and "artist_id" in df.columns])
 
-    genres_rows = []
-    for group in chunked(list(artist_ids), 50):
-        arts = sp.artists(group)["artists"] if group else []
-        for a in arts:
-            genres_rows.append({
-                "artist_id": a.get("id"),
-                "artist_name": a.get("name"),
-                "genres": a.get("genres", [])
-            })
-        time.sleep(0.05)
-    genres_df = pd.DataFrame(genres_rows)
+    genres_df = fetch_artist_genres(sp, artist_ids)
 
     # 6) Save everything that exists
     if not top_artists.empty: top_artists.to_csv(f"{DATA_DIR}/top_artists.csv", index=False)
     if not top_tracks.empty:  top_tracks.to_csv(f"{DATA_DIR}/top_tracks.csv", index=False)
-    if not recent_df.empty:   recent_df.to_csv(f"{DATA_DIR}/recently_played.csv", index=False)
-    if not saved_df.empty:    saved_df.to_csv(f"{DATA_DIR}/saved_tracks.csv", index=False)
+    if not recent_df.empty:   write_csv(recent_df, f"{DATA_DIR}/recently_played.csv")
+    if not saved_df.empty:    write_csv(saved_df, f"{DATA_DIR}/saved_tracks.csv")
     if not feats_df.empty:    feats_df.to_csv(f"{DATA_DIR}/audio_features.csv", index=False)
-    if not genres_df.empty:   genres_df.to_csv(f"{DATA_DIR}/artist_genres.csv", index=False)
+    if not genres_df.empty:   genres_df.assign(genres=genres_df["genres"].map(json.dumps)) \
+                                       .to_csv(f"{DATA_DIR}/artist_genres.csv", index=False)
+
+    # Parquet copies feed the build scripts: typed columns and a native list column for genres
+    for name, df in (("recently_played", recent_df), ("saved_tracks", saved_df), ("artist_genres", genres_df)):
+        if not df.empty:
+            df.to_parquet(f"{DATA_DIR}/{name}.parquet", engine="pyarrow", compression="zstd", index=False)
 
     print("✅ Data refresh complete. Wrote:")
     if not top_artists.empty: print("- data/processed/top_artists.csv")
     if not top_tracks.empty:  print("- data/processed/top_tracks.csv")
-    if not recent_df.empty:   print("- data/processed/recently_played.csv")
-    if not saved_df.empty:    print("- data/processed/saved_tracks.csv")
+    if not recent_df.empty:   print("- data/processed/recently_played.csv (+ .parquet)")
+    if not saved_df.empty:    print("- data/processed/saved_tracks.csv (+ .parquet)")
     if not feats_df.empty:    print("- data/processed/audio_features.csv")
-    if not genres_df.empty:   print("- data/processed/artist_genres.csv")
+    if not genres_df.empty:   print("- data/processed/artist_genres.csv (+ .parquet)")
 
 if __name__ == "__main__":
     main()
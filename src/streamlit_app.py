@@ -1,71 +1,121 @@
 # src/streamlit_app.py
-import ast
-from pathlib import Path
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import streamlit as st
 
-st.set_page_config(page_title="Spotify Genre Analyzer", layout="wide")
-PROC = Path("data/processed")
+from data_io import load_processed, source_version
 
+st.set_page_config(page_title="Spotify Genre Analyzer", layout="wide")
 # ---------- helpers ----------
-def load_csv(path: Path, parse_dates=None) -> pd.DataFrame:
-    if not path.exists():
-        return pd.DataFrame()
-    return pd.read_csv(path, parse_dates=parse_dates)
-
-def friendly_cols(df: pd.DataFrame) -> pd.DataFrame:
-    mapping = {
-        "track_name": "Track Name",
-        "artist_name": "Artist",
-        "album_name": "Album",
-        "played_at": "Played At",
-        "added_at": "Added At",
-        "time_range": "Time Range",
-        "genre": "Genre",
-        "size_all": "Artists in Library",
-        "size_30": "Artists in Last 30 Days",
-        "pct_30": "% of Last 30 Days",
-        "pct_all": "% of Library",
-        "lift": "Lift vs Library",
-    }
-    cols = {c: mapping[c] for c in df.columns if c in mapping}
-    return df.rename(columns=cols)
-
-def ensure_genre_list(df_gen: pd.DataFrame) -> pd.DataFrame:
-    if df_gen.empty:
-        return df_gen
-    g = df_gen.copy()
-    if "genres" in g.columns:
-        def _to_list(x):
-            if isinstance(x, list):
-                return x
-            if isinstance(x, str):
-                try:
-                    v = ast.literal_eval(x)
-                    return v if isinstance(v, list) else []
-                except Exception:
-                    return [s.strip() for s in x.split(",")] if x else []
-            return []
-        g["genres"] = g["genres"].apply(_to_list)
-    return g
-
-def explode_genres(df_tracks: pd.DataFrame, df_genres: pd.DataFrame) -> pd.DataFrame:
-    """Join by artist_id only; explode to genre rows."""
-    if df_tracks.empty or df_genres.empty:
+FRIENDLY_NAMES = {
+    "track_name": "Track Name",
+    "artist_name": "Artist",
+    "album_name": "Album",
+    "played_at": "Played At",
+    "added_at": "Added At",
+    "time_range": "Time Range",
+    "genre": "Genre",
+    "size_all": "Artists in Library",
+    "size_30": "Artists in Last 30 Days",
+    "pct_30": "% of Last 30 Days",
+    "pct_all": "% of Library",
+    "lift": "Lift vs Library",
+}
+_SOURCE_NAMES = {v: k for k, v in FRIENDLY_NAMES.items()}
+
+def friendly_cols(df: pd.DataFrame, columns: list) -> pd.DataFrame:
+    """Select `columns` (given by their friendly names) and label them, in one step."""
+    return df[[_SOURCE_NAMES.get(c, c) for c in columns]].set_axis(columns, axis=1)
+
+@st.cache_data(show_spinner=False)
+def artist_genre_long(_df_genres: pd.DataFrame, version: tuple) -> pd.DataFrame:
+    """One (artist_id, genre) row per tag; exploded once per data version and shared by every section."""
+    if _df_genres.empty:
+        return pd.DataFrame(columns=["artist_id", "genre"])
+    return (
+        _df_genres.explode("genres")
+                 .rename(columns={"genres": "genre"})
+                 .dropna(subset=["genre"])[["artist_id", "genre"]]
+                 .astype({"genre": "category"})
+    )
+
+def explode_genres(df_tracks: pd.DataFrame, genre_long: pd.DataFrame) -> pd.DataFrame:
+    """Join by artist_id only against artist_genre_long; one row per (track row, genre)."""
+    if df_tracks.empty or genre_long.empty:
         return pd.DataFrame(columns=list(df_tracks.columns) + ["genre"])
-    g = ensure_genre_list(df_genres)
-    g = g.explode("genres").rename(columns={"genres": "genre"})
     # join on artist_id only; keep original artist_name from tracks
-    return (
-        df_tracks.merge(g[["artist_id", "genre"]], on="artist_id", how="left")
-                 .dropna(subset=["genre"])
+    return df_tracks.merge(genre_long, on="artist_id", how="inner")
+
+def share_artist_categories(*frames: pd.DataFrame) -> list:
+    """Cast artist_id to one CategoricalDtype across frames so merges/groupbys run on int codes."""
+    present = [df for df in frames if "artist_id" in df.columns]
+    if not present:
+        return list(frames)
+    ids = np.concatenate([df["artist_id"].dropna().to_numpy(dtype=object) for df in present])
+    dtype = pd.CategoricalDtype(pd.unique(ids))
+    return [df.astype({"artist_id": dtype}) if "artist_id" in df.columns else df for df in frames]
+
+@st.cache_data(show_spinner=False)
+def compute_summary(_saved: pd.DataFrame, _recent_30: pd.DataFrame, _genre_long: pd.DataFrame,
+                    version: tuple) -> pd.DataFrame:
+    """Per-genre artist counts, shares and lift.
+
+    Only depends on the data files, not on the sidebar controls, so it is cached on
+    `version` (source mtimes) and slider changes just re-slice the result.
+    """
+    saved, recent_30, genre_long = _saved, _recent_30, _genre_long
+    lib_art = saved[["artist_id", "artist_name"]].drop_duplicates() if not saved.empty else saved
+    lib_art_gen = explode_genres(lib_art, genre_long)
+    lib_counts = (
+        lib_art_gen.drop_duplicates(["genre", "artist_id"]).groupby("genre", observed=True).size().rename("size_all")
+        if not lib_art_gen.empty else pd.Series(dtype="int64", name="size_all")
     )
 
+    r30_art = recent_30[["artist_id", "artist_name"]].drop_duplicates() if not recent_30.empty else recent_30
+    r30_art_gen = explode_genres(r30_art, genre_long)
+    r30_counts = (
+        r30_art_gen.drop_duplicates(["genre", "artist_id"]).groupby("genre", observed=True).size().rename("size_30")
+        if not r30_art_gen.empty else pd.Series(dtype="int64", name="size_30")
+    )
+
+    # align both counts on one genre index, then derive shares and lift in a single pass
+    idx = lib_counts.index.union(r30_counts.index)
+    a = lib_counts.reindex(idx, fill_value=0).to_numpy()
+    b = r30_counts.reindex(idx, fill_value=0).to_numpy()
+    pct_all = a / a.sum() if a.sum() else np.zeros_like(a, dtype=float)
+    pct_30 = b / b.sum() if b.sum() else np.zeros_like(b, dtype=float)
+    return pd.DataFrame({
+        "genre": idx,
+        "size_all": a,
+        "size_30": b,
+        "pct_all": pct_all,
+        "pct_30": pct_30,
+        "lift": np.divide(pct_30, pct_all, out=np.zeros_like(pct_30), where=pct_all > 0),
+    })
+
+@st.cache_data(show_spinner=False)
+def recent_tracks_by_genre(_recent_30: pd.DataFrame, _genre_long: pd.DataFrame, version: tuple):
+    """Last-30-day track rows exploded by genre, plus genre -> row positions.
+
+    Built once per data version so a drill-down selection is just an iloc slice.
+    """
+    cols = ["track_id", "track_name", "artist_id", "artist_name", "album_name", "played_at"]
+    frame = explode_genres(_recent_30[cols], _genre_long).reset_index(drop=True)
+    if frame.empty:
+        return frame, {}
+    return frame, frame.groupby("genre", observed=True, sort=False).indices
+
 # ---------- load cached ----------
-recent   = load_csv(PROC / "recently_played.csv", parse_dates=["played_at"])
-saved    = load_csv(PROC / "saved_tracks.csv",     parse_dates=["added_at"])
-genres   = load_csv(PROC / "artist_genres.csv")  # artist_id, artist_name, genres
-features = load_csv(PROC / "audio_features.csv") # optional / may be empty
+recent   = load_processed("recently_played", parse_dates=["played_at"], sort_by="played_at")
+saved    = load_processed("saved_tracks",    parse_dates=["added_at"])
+genres   = load_processed("artist_genres")   # artist_id, artist_name, genres
+features = load_processed("audio_features")  # optional / may be empty
+recent, saved, genres = share_artist_categories(recent, saved, genres)
+# artist_id categories depend on all three inputs, so key derived caches on all of them
+data_version = source_version("recently_played", "saved_tracks", "artist_genres")
+genre_long = artist_genre_long(genres, data_version)
 
 # ---------- header ----------
 st.title("Spotify Wrapped (WIP) – Genre Focus")
@@ -82,37 +132,12 @@ if recent.empty or "played_at" not in recent.columns:
     st.warning("No recent plays found (or `played_at` column missing). Run the fetch step first.")
     recent_30 = recent.iloc[0:0]
 else:
-    cutoff = recent["played_at"].max() - pd.Timedelta(days=30)
-    recent_30 = recent[recent["played_at"] >= cutoff]
+    # recent is sorted by played_at at load, so the window is a binary search + tail slice
+    cutoff = recent["played_at"].iloc[-1] - pd.Timedelta(days=30)
+    recent_30 = recent.iloc[recent["played_at"].searchsorted(cutoff, side="left"):]
 
 # ---------- genre summary (artist-based) ----------
-lib_art = saved[["artist_id", "artist_name"]].drop_duplicates() if not saved.empty else saved
-lib_art_gen = explode_genres(lib_art, genres)
-lib_counts = (
-    lib_art_gen.groupby("genre")["artist_id"].nunique().rename("size_all")
-    if not lib_art_gen.empty else pd.Series(dtype="int64", name="size_all")
-)
-
-r30_art = recent_30[["artist_id", "artist_name"]].drop_duplicates() if not recent_30.empty else recent_30
-r30_art_gen = explode_genres(r30_art, genres)
-r30_counts = (
-    r30_art_gen.groupby("genre")["artist_id"].nunique().rename("size_30")
-    if not r30_art_gen.empty else pd.Series(dtype="int64", name="size_30")
-)
-
-summary = pd.concat([lib_counts, r30_counts], axis=1).fillna(0)
-if summary.empty:
-    summary = pd.DataFrame(columns=["size_all", "size_30"])
-
-summary = (
-    summary.assign(
-        pct_all=lambda d: (d["size_all"] / d["size_all"].sum()) if d["size_all"].sum() else 0,
-        pct_30=lambda d: (d["size_30"] / d["size_30"].sum()) if d["size_30"].sum() else 0,
-        lift=lambda d: (d["pct_30"] / d["pct_all"]).replace([pd.NA, pd.NaT, float("inf")], 0)
-    )
-    .reset_index()
-    .rename(columns={"index": "genre"})
-)
+summary = compute_summary(saved, recent_30, genre_long, data_version)
 
 # ---------- controls ----------
 k = st.sidebar.slider("How many genres to show (by Lift vs Library)", min_value=5, max_value=50, value=20, step=5)
@@ -120,37 +145,39 @@ k = st.sidebar.slider("How many genres to show (by Lift vs Library)", min_value=
 # ---------- top genres table ----------
 st.subheader("Top Genres by Lift (Last 30 Days vs Library)")
 top_genres = summary.sort_values("lift", ascending=False).head(k)
+# scale/round once in NumPy and let the Arrow-serialized grid do display formatting
+# (no Styler: it formats cell by cell in Python and stringifies the columns)
+top_view = top_genres.assign(
+    pct_30=(top_genres["pct_30"].to_numpy() * 100).round(1),
+    pct_all=(top_genres["pct_all"].to_numpy() * 100).round(1),
+    lift=top_genres["lift"].to_numpy().round(2),
+)
 st.dataframe(
-    friendly_cols(top_genres)[
-        ["Genre", "Artists in Last 30 Days", "% of Last 30 Days", "Artists in Library", "% of Library", "Lift vs Library"]
-    ].style.format({
-        "% of Last 30 Days": "{:.1%}",
-        "% of Library": "{:.1%}",
-        "Lift vs Library": "{:.2f}",
-    }),
+    friendly_cols(top_view, [
+        "Genre", "Artists in Last 30 Days", "% of Last 30 Days", "Artists in Library", "% of Library", "Lift vs Library"
+    ]),
+    column_config={
+        "% of Last 30 Days": st.column_config.NumberColumn(format="%.1f%%"),
+        "% of Library": st.column_config.NumberColumn(format="%.1f%%"),
+        "Lift vs Library": st.column_config.NumberColumn(format="%.2f"),
+    },
     use_container_width=True,
 )
 
 # ---------- genre drill-down ----------
 if not top_genres.empty and not recent_30.empty:
     picked_genre = st.selectbox("Drill down to see the tracks behind a genre:", top_genres["genre"])
-    recent_30_tracks = recent_30[["track_id", "track_name", "artist_id", "artist_name", "album_name", "played_at"]]
-    r30_track_gen = explode_genres(recent_30_tracks, genres)
-    r30_track_gen = r30_track_gen[r30_track_gen["genre"] == picked_genre]
+    r30_track_gen, genre_rows = recent_tracks_by_genre(recent_30, genre_long, data_version)
+    r30_track_gen = r30_track_gen.iloc[genre_rows.get(picked_genre, [])]
 
     st.markdown(f"### Tracks contributing to **{picked_genre}** in the last 30 days")
     if r30_track_gen.empty:
         st.info("No recent plays found for this genre in the last 30 days.")
     else:
-        t_recent = (
-            r30_track_gen.drop_duplicates(subset=["track_id"])
-                         .rename(columns={
-                             "track_name": "Track Name",
-                             "artist_name": "Artist",
-                             "album_name": "Album",
-                             "played_at": "Played At",
-                         })[["Track Name", "Artist", "Album", "Played At"]]
-                         .sort_values("Played At", ascending=False)
+        t_recent = friendly_cols(
+            # rows are in ascending played_at order, so keep="last" keeps each track's newest play
+            r30_track_gen.drop_duplicates(subset=["track_id"], keep="last").sort_values("played_at", ascending=False),
+            ["Track Name", "Artist", "Album", "Played At"],
         )
         st.dataframe(t_recent, use_container_width=True)
 
@@ -159,20 +186,14 @@ if not top_genres.empty and not recent_30.empty:
         st.caption("—")
     else:
         artists_this = r30_track_gen[["artist_id", "artist_name"]].drop_duplicates()
-
-        # Merge on artist_id; unify artist_name
-        g2 = genres.merge(artists_this, on="artist_id", how="inner", suffixes=("_lib", "_r30"))
-        g2 = ensure_genre_list(g2)
-        # Use the name from recent plays if present, otherwise library name
-        if "artist_name_r30" in g2.columns or "artist_name_lib" in g2.columns:
-            g2["artist_name"] = g2.get("artist_name_r30", pd.Series(index=g2.index)).combine_first(
-                g2.get("artist_name_lib", pd.Series(index=g2.index))
-            )
-
-        also = g2.explode("genres").rename(columns={"genres": "Genre"})
+        also = (
+            genre_long.merge(artists_this, on="artist_id", how="inner")
+                      .rename(columns={"genre": "Genre"})
+        )
         also = also[also["Genre"] != picked_genre]
         also_counts = (
-            also.groupby("Genre")["artist_id"].nunique()
+            also[["Genre", "artist_id"]].drop_duplicates()
+                .groupby("Genre", observed=True).size()
                 .rename("Artists")
                 .reset_index()
                 .sort_values("Artists", ascending=False)
@@ -188,21 +209,15 @@ if recent_30.empty or genres.empty:
     st.caption("No recent plays window or genres to analyze.")
 else:
     r30_artists = recent_30[["artist_id", "artist_name"]].drop_duplicates()
-    g3 = genres.merge(r30_artists, on="artist_id", how="inner", suffixes=("_lib", "_r30"))
-    g3 = ensure_genre_list(g3)
-
-    # unify artist_name column
-    if "artist_name_r30" in g3.columns or "artist_name_lib" in g3.columns:
-        g3["artist_name"] = g3.get("artist_name_r30", pd.Series(index=g3.index)).combine_first(
-            g3.get("artist_name_lib", pd.Series(index=g3.index))
-        )
+    # artist names come from recent plays; genres only contributes the tag list
+    g3 = genres[["artist_id", "genres"]].merge(r30_artists, on="artist_id", how="inner")
 
-    g3["n_tags"] = g3["genres"].apply(lambda lst: len(lst or []))
+    g3["n_tags"] = g3["genres"].list.len()  # Arrow list_value_length
     multi = g3[g3["n_tags"] >= 3].copy()
     if multi.empty:
         st.caption("(No artists with 3+ tags in the last 30 days.)")
     else:
-        multi["All Tags"] = multi["genres"].apply(lambda lst: ", ".join(lst) if isinstance(lst, list) else "")
+        multi["All Tags"] = pd.arrays.ArrowExtensionArray(pc.binary_join(pa.array(multi["genres"]), ", "))
         multi_view = (
             multi[["artist_name", "All Tags", "n_tags"]]
             .drop_duplicates()
@@ -217,15 +232,8 @@ with st.expander("Peek: Latest 50 Recent Plays (from cache)"):
         st.caption("—")
     else:
         st.dataframe(
-            friendly_cols(
-                recent.sort_values("played_at", ascending=False)
-                      .rename(columns={
-                          "track_name": "Track Name",
-                          "artist_name": "Artist",
-                          "album_name": "Album",
-                          "played_at": "Played At",
-                      })
-            )[["Played At", "Track Name", "Artist", "Album"]].head(50),
+            friendly_cols(recent.nlargest(50, "played_at"),
+                          ["Played At", "Track Name", "Artist", "Album"]),
             use_container_width=True,
         )
 
@@ -235,14 +243,7 @@ with st.expander("Peek: Library Stats"):
     else:
         st.write(f"Saved tracks in library: **{len(saved):,}**")
         st.dataframe(
-            friendly_cols(
-                saved.sort_values("added_at", ascending=False)
-                     .rename(columns={
-                         "track_name": "Track Name",
-                         "artist_name": "Artist",
-                         "album_name": "Album",
-                         "added_at": "Added At",
-                     })
-            )[["Added At", "Track Name", "Artist", "Album"]].head(50),
+            friendly_cols(saved.nlargest(50, "added_at"),
+                          ["Added At", "Track Name", "Artist", "Album"]),
             use_container_width=True,
         )
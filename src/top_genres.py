@@ -1,14 +1,21 @@
 import os
 from collections import Counter
+from itertools import chain
 
 from dotenv import load_dotenv
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
+import matplotlib
+
+load_dotenv()  # before the backend choice, so HEADLESS can be set in .env like the other settings
+HEADLESS = bool(os.getenv("HEADLESS"))
+if HEADLESS:
+    matplotlib.use("Agg")  # no GUI toolkit init; the chart is written to a PNG instead
 import matplotlib.pyplot as plt
 
-def main():
-    load_dotenv()
+FIGURE_PATH = "reports/figures/top_genres.png"
 
+def main():
     client_id = os.getenv("SPOTIPY_CLIENT_ID")
     client_secret = os.getenv("SPOTIPY_CLIENT_SECRET")
     redirect_uri = os.getenv("SPOTIPY_REDIRECT_URI", "http://localhost:8888/callback")
@@ -31,16 +38,14 @@ def main():
 
     top_artists = sp.current_user_top_artists(limit=limit, time_range=time_range)
 
-    genres = []
-    for artist in top_artists.get("items", []):
-        genres.extend(artist.get("genres", []))
+    counts = Counter(
+        chain.from_iterable(a.get("genres", ()) for a in top_artists.get("items", ()))
+    ).most_common(top_n)
 
-    if not genres:
+    if not counts:
         print("No genres found. Try changing time_range or verify your listening history.")
         return
 
-    counts = Counter(genres).most_common(top_n)
-
     print(f"\nTop {top_n} Genres ({time_range}):")
     for g, c in counts:
         print(f"{g}: {c}")
@@ -52,7 +57,12 @@ def main():
     plt.title(f"Top {top_n} Spotify Genres ({time_range})")
     plt.xlabel("Count")
     plt.tight_layout()
-    plt.show()
+    if HEADLESS:
+        os.makedirs(os.path.dirname(FIGURE_PATH), exist_ok=True)
+        plt.savefig(FIGURE_PATH, dpi=120)
+        print(f"Saved chart to {FIGURE_PATH}")
+    else:
+        plt.show()
 
 if __name__ == "__main__":
     main()
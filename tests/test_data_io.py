@@ -0,0 +1,25 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+import data_io  # noqa: E402
+
+def test_csv_only_dir_survives_second_load(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_io, "PROC", tmp_path)
+    pd.DataFrame({
+        "artist_id": ["a1", "a2", "a3"],
+        "artist_name": ["A", "B", "C"],
+        "genres": ['["indie rock", "shoegaze"]', "['lo-fi']", None],
+    }).to_csv(tmp_path / "artist_genres.csv", index=False)
+
+    first = data_io.load_processed("artist_genres")
+    assert data_io.source_path("artist_genres").suffix == ".parquet"
+
+    second = data_io.load_processed("artist_genres")  # now served from the sidecar
+    assert second["genres"].dtype == data_io.GENRE_LIST
+    assert second["genres"].list.len().tolist() == [2, 1, 0]
+    assert second["genres"].equals(first["genres"])
+    # the build scripts read the same file with plain pandas
+    assert pd.read_parquet(tmp_path / "artist_genres.parquet")["genres"].map(len).tolist() == [2, 1, 0]